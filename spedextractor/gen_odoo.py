@@ -1,7 +1,13 @@
+import csv
+import functools
+import io
 import logging
-from collections import OrderedDict, defaultdict
+import os
+import re
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import click
 from black import FileMode, format_str
@@ -29,31 +35,73 @@ IMPORTS = """import textwrap
 from odoo import fields, models
 """
 
+CONCRETE_MODEL = """
+
+class Registro{code}(models.Model):
+    "{short_desc}"
+    _description = textwrap.dedent("    %s" % (__doc__,))
+    _name = "l10n_br_sped.{mod}.{code_lc}"
+    _inherit = "l10n_br_sped.{mod}.{version}.{code_lc}"
+
+    # @api.model
+    # def _map_from_odoo(self, record, parent_record, declaration):
+    #     return {{
+                """
+
+# field type and cardinality descriptors shared by all the simple type fields:
+_XSD = "{http://www.w3.org/2001/XMLSchema}"
+_T_DATE = [AttrType(qname=_XSD + "date", native=True)]
+_T_INT = [AttrType(qname=_XSD + "integer", native=True)]
+_T_FLOAT = [AttrType(qname=_XSD + "float", native=True)]
+_T_STRING = [AttrType(qname=_XSD + "string", native=True)]
+_OPTIONAL = Restrictions(min_occurs=0)
+_REQUIRED = Restrictions(min_occurs=1)
+
+_is_date_code = re.compile(r"DT_|DAT_|DATA").match
+_is_value_code = re.compile(r"VL_|VAL_|VALOR").match
+
+# sort prefix of the blocos that are not in alphabetic order in the SPED layout:
+_BLOCO_PREFIX = {"0": "0", "1": "2", "9": "3"}
+
+# structure docstring indentation by register level - 1:
+_INDENTS = ["  " * i for i in range(16)]
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_extract(mod, code, desc, limit):
+    """extract_string_and_help without label deduplication, so it can be cached."""
+    return extract_string_and_help(mod, code, desc, set(), limit)
+
+
+@functools.lru_cache(maxsize=128)
+def _format_source(source):
+    return format_str(source, mode=FileMode())
+
 
 def collect_register_children(registers):
-    """read the registers hierarchy."""
+    """read the registers hierarchy in a single pass."""
+    for register_info in registers:
+        register_info["children_o2m"] = []
+        register_info["children_m2o"] = []
+
+    open_parents = {}  # level -> last register seen at that level
     for register_info in registers:
-        if register_info["level"] > 1:
-            collect_children = False
-            children_o2m = []
-            children_m2o = []
-            level = register_info["level"]
-            for r in registers:
-                if r["code"] == register_info["code"]:
-                    collect_children = True
-                    continue
-                if collect_children:
-                    if r["level"] == level + 1:
-                        if r["card"].strip() == "1:1" or r["card"].strip() == "1;1":
-                            children_m2o.append(r)
-                        else:
-                            children_o2m.append(r)
-                            r["o2m_parent"] = register_info
-                        r["parent"] = register_info
-                    elif r["level"] <= level:
-                        break
-            register_info["children_o2m"] = children_o2m
-            register_info["children_m2o"] = children_m2o
+        level = register_info["level"]
+        if level <= 1:
+            # bloco opening/closing registers are never parents of other registers
+            open_parents.clear()
+            continue
+        parent = open_parents.get(level - 1)
+        if parent is not None:
+            if register_info["card"].strip() in ("1:1", "1;1"):
+                parent["children_m2o"].append(register_info)
+            else:
+                parent["children_o2m"].append(register_info)
+                register_info["o2m_parent"] = parent
+            register_info["parent"] = parent
+        open_parents[level] = register_info
+        for deeper_level in [lvl for lvl in open_parents if lvl > level]:
+            del open_parents[deeper_level]
 
 
 def _get_alphanum_sequence(register_code):
@@ -61,70 +109,78 @@ def _get_alphanum_sequence(register_code):
     Used to order the SPED register in the same order
     as in the SPED layout (the register name alone won't cut it)
     """
-    bloco_key = register_code[0]
-    if bloco_key == "0":
-        return "0" + register_code
-    elif bloco_key == "1":
-        return "2" + register_code
-    elif bloco_key == "9":
-        return "3" + register_code
-    else:
-        return "1" + register_code
+    return _BLOCO_PREFIX.get(register_code[0], "1") + register_code
 
 
 def get_structure(mod, registers):
-    structure = f"STRUCTURE SPED {mod.upper()}"
+    parts = [f"STRUCTURE SPED {mod.upper()}"]
     for reg in registers:
-        short_desc, left = extract_string_and_help(
-            mod, reg["code"], reg["desc"], set(), 100
-        )
+        code = reg["code"]
+        level = reg["level"]
+        short_desc, left = _cached_extract(mod, code, reg["desc"], 100)
         reg["short_desc"] = short_desc
 
-        if reg["level"] == 0:
+        if level == 0:
             continue
-        if reg["level"] == 1:
-            if "990" not in reg["code"] and "099" not in reg["code"]:  # not enceramento
-                structure += "\n\n<BLOCO " + reg["code"][0] + ">"
+        if level == 1:
+            if code[1:] not in {"990", "099"}:  # not enceramento
+                parts.append("\n\n<BLOCO " + code[0] + ">")
             continue
-        if reg["level"] == 2:
-            structure += "\n"
+        if level == 2:
+            parts.append("\n")
             desc = reg["short_desc"].upper()
-        elif reg["level"] == 3:
+        elif level == 3:
             desc = reg["short_desc"]
         else:
             desc = ""
-        if desc == reg["code"]:
+        if desc == code:
             desc = reg["desc"][:40] + "..."
         if reg.get("o2m_parent"):
-            structure += (
-                "\n"
-                + "  " * (reg["level"] - 1)
-                + "\u2261 "
-                + (reg["code"] + " " + desc).strip()
+            parts.append(
+                "\n" + _INDENTS[level - 1] + "\u2261 " + (code + " " + desc).strip()
             )
         else:
-            structure += (
-                "\n"
-                + "  " * (reg["level"] - 1)
-                + "- "
-                + (reg["code"] + " " + desc).strip()
+            parts.append(
+                "\n" + _INDENTS[level - 1] + "- " + (code + " " + desc).strip()
             )
-    return structure
+    return "".join(parts)
 
 
 class SpedFilters(OdooFilters):
+    registers_by_code: Dict[str, dict]
+    level_by_code: Dict[str, int]
+    fields_by_register_and_code: Dict[Tuple[str, str], dict]
+    all_complex_types_by_qname: Dict[str, Class]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the templates ask the same names over and over:
+        self._registry_name_cache: Dict[Tuple[str, str, str], str] = {}
+        self._registry_comodel_cache: Dict[Tuple[str, ...], str] = {}
+
     def registry_name(
         self, name: str = "", parents: List[Class] = [], type_names: List[str] = []
     ) -> str:
-        name = self.class_name(name)
-        return f"{self.schema}.{self.version}.{name[-4:].lower()}"
+        key = (self.schema, self.version, name)
+        registry_name = self._registry_name_cache.get(key)
+        if registry_name is None:
+            name = self.class_name(name)
+            registry_name = f"{self.schema}.{self.version}.{name[-4:].lower()}"
+            self._registry_name_cache[key] = registry_name
+        return registry_name
 
     def registry_comodel(self, type_names: List[str]):
-        # NOTE: we take only the last part of inner Types with .split(".")[-1]
-        # but if that were to create Type duplicates we could change that.
-        clean_type_names = type_names[-1].replace('"', "").split(".")
-        comodel = self.registry_name(clean_type_names[-1], type_names=clean_type_names)
-        comodel = ".".join(comodel.split(".")[0:2] + comodel.split(".")[-1:])
+        key = (self.schema, self.version, *type_names)
+        comodel = self._registry_comodel_cache.get(key)
+        if comodel is None:
+            # NOTE: we take only the last part of inner Types with .split(".")[-1]
+            # but if that were to create Type duplicates we could change that.
+            clean_type_names = type_names[-1].replace('"', "").split(".")
+            comodel = self.registry_name(
+                clean_type_names[-1], type_names=clean_type_names
+            )
+            comodel = ".".join(comodel.split(".")[0:2] + comodel.split(".")[-1:])
+            self._registry_comodel_cache[key] = comodel
         return comodel
 
     def class_properties(
@@ -132,8 +188,7 @@ class SpedFilters(OdooFilters):
         obj: Class,
         parents: List[Class],
     ) -> str:
-        register = list(filter(lambda x: x["code"] == obj.name[-4:], self.registers))[0]
-        return f"_sped_level = {register['level']}"
+        return f"_sped_level = {self.level_by_code[obj.name[-4:]]}"
 
     def odoo_class_name(self, obj: Class, parents: List[Class] = []):
         return obj.name
@@ -172,21 +227,14 @@ class SpedFilters(OdooFilters):
             kwargs["ondelete"] = "cascade"
         elif attr.name.startswith("reg_") and attr.name.endswith("_ids"):
             target_reg_code = attr.name.replace("reg_", "").replace("_ids", "")
-            target_register = list(
-                filter(lambda x: x["code"] == target_reg_code, self.registers)
-            )[0]
+            target_register = self.registers_by_code[target_reg_code]
             kwargs["sped_card"] = target_register["card"]
             if target_register.get("spec_required") == "Sim":
                 kwargs["sped_required"] = True
 
         else:
             # simple types
-            field = list(
-                filter(
-                    lambda x: x["code"] == attr.name and x["register"] == obj.name[-4:],
-                    self.fields,
-                )
-            )[0]
+            field = self.fields_by_register_and_code[(obj.name[-4:], attr.name)]
 
             if field.get("xsd_type"):
                 kwargs["xsd_type"] = field["xsd_type"]
@@ -216,6 +264,18 @@ class SpedFilters(OdooFilters):
 
         return kwargs
 
+    def _try_many2one_field_definition(
+        self, obj: Class, attr: Attr, type_names: str, kwargs: OrderedDict
+    ):
+        """
+        xsdata-odoo override: look the comodel up by qname instead of scanning
+        all_complex_types for every relational field.
+        """
+        if attr.types[0].qname in self.all_complex_types_by_qname:
+            kwargs["comodel_name"] = self.registry_comodel(type_names)
+            kwargs.move_to_end("comodel_name", last=False)
+            return f"fields.Many2one({self.format_arguments(kwargs, 4)})"
+
     def _extract_number_attrs(self, obj: Class, attr: Attr, kwargs: Dict[str, Dict]):
         python_type = attr.types[0].datatype.code
         if python_type in ("float", "decimal", "integer"):
@@ -223,11 +283,7 @@ class SpedFilters(OdooFilters):
 
             # Brazilian fiscal documents:
             if xsd_type.startswith("TDec_"):
-                if int(xsd_type[7:9]) != 2 or (
-                    not attr.name.startswith("VL_")
-                    and not attr.name.startswith("VAL_")
-                    and not attr.name.startswith("VALOR")
-                ):
+                if int(xsd_type[7:9]) != 2 or not _is_value_code(attr.name):
                     kwargs["digits"] = (
                         int(xsd_type[5:7]),
                         int(xsd_type[7:9]),
@@ -236,22 +292,12 @@ class SpedFilters(OdooFilters):
                     kwargs[
                         "currency_field"
                     ] = "brl_currency_id"  # use company_curreny_id?
-            elif attr.name.startswith(("VL_", "VAL_", "VALOR")):
+            elif _is_value_code(attr.name):
                 kwargs["currency_field"] = "brl_currency_id"  # use company_curreny_id?
 
 
-@click.option(
-    "--year",
-    default=MOST_RECENT_YEAR,
-    show_default=True,
-    type=click.IntRange(OLDEST_YEAR, MOST_RECENT_YEAR),
-    help="Operate on a specific year's folder, "
-    f"can be between {OLDEST_YEAR} and {MOST_RECENT_YEAR}",
-)
-@click.command()
-def main(year):
-    """Generate Odoo models."""
-
+def _generate_for_module(mod, year):
+    """Generate the models, views and security files of a SPED module."""
     config = GeneratorConfig()
     config.conventions.field_name.safe_prefix = (
         "NO_PREFIX_NO_SAFE_NAME"  # no field prefix
@@ -268,321 +314,356 @@ def main(year):
     generator.filters.register(generator.env)
     generator.filters.python_inherit_model = "models.AbstractModel"
 
-    for mod in MODULES:
-        print(f"\n\n********************* Generating {mod} *********************")
-        schema = f"l10n_br_sped.{mod}"
-        generator.filters.inherit_model = f"l10n_br_sped.mixin.{mod}"
-        generator.filters.schema = schema
-        version = get_version(mod, year)
-        generator.filters.version = version
-        mod_fields = get_fields(mod, year)
-
-        security_csv = f""""id","name","model_id:id","group_id:id","perm_read","perm_write","perm_create","perm_unlink"
-"""
+    print(f"\n\n********************* Generating {mod} *********************")
+    schema = f"l10n_br_sped.{mod}"
+    generator.filters.inherit_model = f"l10n_br_sped.mixin.{mod}"
+    generator.filters.schema = schema
+    version = get_version(mod, year)
+    generator.filters.version = version
+    mod_fields = get_fields(mod, year)
+    fields_by_register = defaultdict(list)
+    for field in mod_fields:
+        fields_by_register[field["register"]].append(field)
+
+    security_csv = io.StringIO()
+    security_csv.write(
+        '"id","name","model_id:id","group_id:id",'
+        '"perm_read","perm_write","perm_create","perm_unlink"\n'
+    )
+    security_writer = csv.writer(security_csv, lineterminator="\n")
 
-        views_xml = '<?xml version="1.0" encoding="UTF-8"?>\n<odoo>'
-        views_xml += (
+    views_xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<odoo>']
+    views_xml_parts.append(
+        (
             '\n    <menuitem name="%s"'
             ' parent="l10n_br_sped_base.menu_root" id="%s" sequence="2" />'
-        ) % (mod.replace("_", " ").upper(), mod)
+        )
+        % (mod.replace("_", " ").upper(), mod)
+    )
 
-        action = """\n
+    action = """\n
     <record id="declaration_%s_action" model="ir.actions.act_window">
     <field name="name">%s Declaration</field>
     <field name="res_model">l10n_br_sped.%s.0000</field>
     <field name="view_mode">tree,form</field>
     </record>""" % (
-            mod,
-            mod.upper(),
-            mod,
-        )
-        views_xml += action
+        mod,
+        mod.upper(),
+        mod,
+    )
+    views_xml_parts.append(action)
 
-        views_xml += (
+    views_xml_parts.append(
+        (
             '\n    <menuitem action="declaration_%s_action"'
             ' parent="%s" id="declaration_%s" />'
-        ) % (
+        )
+        % (
             mod,
             mod,
             mod,
         )
+    )
 
-        concrete_models_source = (
-            HEADER + "\nimport textwrap\n\nfrom odoo import models\n"
-        )
-
-        last_bloco = None
-
-        classes = []
-        registers = list(
-            sorted(
-                filter(
-                    lambda x: x["code"][0] != "C"
-                    or mod not in ("ecd", "ecf"),  # filled by the validator
-                    get_registers(mod, year),
-                ),
-                key=lambda x: _get_alphanum_sequence(x["code"]),
-            )
-        )
-        collect_register_children(registers)
-        generator.filters.registers = registers
-        generator.filters.fields = mod_fields
+    concrete_parts = [HEADER + "\nimport textwrap\n\nfrom odoo import models\n"]
 
-        for register in registers:
-            if register["level"] in (0, 1) and register["code"] != "0000":
-                # Blocks and their start/end registers don't need to be in the database
-                continue
+    last_bloco = None
 
-            if register["code"][0] == "9":
-                # bloco 9 is automatic, not ERP data
-                break
-
-            short_desc, left = extract_string_and_help(
-                mod, register["code"], register["desc"], set(), 100
-            )
-            register["short_desc"] = short_desc
+    classes = []
+    skip_bloco_c = mod in ("ecd", "ecf")  # filled by the validator
+    registers = sorted(
+        (
+            r
+            for r in get_registers(mod, year)
+            if not (skip_bloco_c and r["code"][0] == "C")
+        ),
+        key=lambda x: _get_alphanum_sequence(x["code"]),
+    )
+    collect_register_children(registers)
+    generator.filters.registers = registers
+    generator.filters.fields = mod_fields
+    generator.filters.registers_by_code = {r["code"]: r for r in registers}
+    generator.filters.level_by_code = {r["code"]: r["level"] for r in registers}
+
+    # bloco 9 is automatic, not ERP data. _get_alphanum_sequence sorts it last.
+    bloco_9_start = next(
+        (i for i, r in enumerate(registers) if r["code"][0] == "9"), len(registers)
+    )
+    for register in registers[:bloco_9_start]:
+        code = register["code"]
+        code_lc = code.lower()
+        bloco_char = code[0]
+        if register["level"] in (0, 1) and code != "0000":
+            # Blocks and their start/end registers don't need to be in the database
+            continue
 
-            if register["level"] > 1 or register["code"] == "0000":
-                concrete_models_source += (
-                    f"\n\nclass Registro{register['code']}(models.Model):"
-                )
-                concrete_models_source += f"""\n    \"{register['short_desc']}\""""
-                concrete_models_source += (
-                    f"""\n    _description = textwrap.dedent("    %s" % (__doc__,))"""
+        short_desc, left = _cached_extract(mod, code, register["desc"], 100)
+        register["short_desc"] = short_desc
+
+        reg_lines = []
+        if register["level"] > 1 or code == "0000":
+            reg_lines.append(
+                CONCRETE_MODEL.format(
+                    code=code,
+                    short_desc=short_desc,
+                    mod=mod,
+                    version=version,
+                    code_lc=code_lc,
                 )
-                concrete_models_source += f"""\n    _name = \"l10n_br_sped.{mod}.{register['code'].lower()}\""""
-                concrete_models_source += f"""\n    _inherit = \"l10n_br_sped.{mod}.{version}.{register['code'].lower()}\""""
-                concrete_models_source += """
-
-    # @api.model
-    # def _map_from_odoo(self, record, parent_record, declaration):
-    #     return {
-                """
+            )
 
-            bloco_char = register["code"][0]
-            if bloco_char != last_bloco:
-                views_xml += (
-                    '\n\n\n    <menuitem name="BLOCO %s"' ' parent="%s" id="%s_%s" />'
-                ) % (bloco_char, mod, mod, bloco_char.lower())
-            last_bloco = bloco_char
+        if bloco_char != last_bloco:
+            views_xml_parts.append(
+                ('\n\n\n    <menuitem name="BLOCO %s"' ' parent="%s" id="%s_%s" />')
+                % (bloco_char, mod, mod, bloco_char.lower())
+            )
+        last_bloco = bloco_char
 
-            if register["level"] == 2:# or register["code"] == "0000":
-                action_name = register["code"] + " " + register["short_desc"]
-                action = """\n
+        if register["level"] == 2:# or register["code"] == "0000":
+            action_name = code + " " + register["short_desc"]
+            action = """\n
     <record id="%s_%s_action" model="ir.actions.act_window">
         <field name="name">%s</field>
         <field name="res_model">l10n_br_sped.%s.%s</field>
         <field name="view_mode">tree,form</field>
     </record>""" % (
-                    mod,
-                    register["code"].lower(),
-                    action_name,
-                    mod,
-                    register["code"].lower(),
-                )
-                views_xml += action
+                mod,
+                code_lc,
+                action_name,
+                mod,
+                code_lc,
+            )
+            views_xml_parts.append(action)
 
-                views_xml += (
+            views_xml_parts.append(
+                (
                     '\n    <menuitem action="%s_%s_action"'
                     ' parent="%s_%s" id="%s_%s" />'
-                ) % (
+                )
+                % (
                     mod,
-                    register["code"].lower(),
+                    code_lc,
                     mod,
                     bloco_char.lower(),
                     mod,
-                    register["code"].lower(),
+                    code_lc,
                 )
+            )
 
-            name = f"Registro{register['code']}"
-            attrs = []
-
-            # 1st we will make the register fields code unique. Incredibly in the SPED
-            # spec pdfs some register have duplicate field codes.
-            # example: EFD ICMS/IPI C170 with PIS_ALIQ or COFINS_ALIQ
-            # one is the percent and another is the R$ value...
-            # other case in EFD PIS/COFINS M210.
-            # in this case we append the line field index to the dup codes
-            # the field name doesn't really matter as it is not written in the SPED file.
-            unique_codes = set()
-            fields = []
-            for field in list(
-                filter(lambda x: x["register"] == register["code"], mod_fields)
-            ):
-                if field["code"] not in unique_codes:
-                    unique_codes.add(field["code"])
-                else:
-                    field["code"] = f'{field["code"]}_INDEX_{field["index"]}'
-                    unique_codes.add(field["code"])
-                fields.append(field)
-
-            for field in fields:
-                if field["code"] in ("REG",):  # no need for DB field for fixed field
-                    continue
-                if not field.get("type"):
-                    field["type"] = "char"
-
-                # listing all fields helps writting and reviewing mappings:
-                max_desc = 88 - len(field["code"]) - 29
-                concrete_models_source += (
-                    f"""    #         "{field["code"]}": 0,  # {field["desc"][0:max_desc]}{len(field["desc"]) > max_desc and "..." or ""}\n"""
-                )
+        name = f"Registro{code}"
+        attrs = []
+
+        # 1st we will make the register fields code unique. Incredibly in the SPED
+        # spec pdfs some register have duplicate field codes.
+        # example: EFD ICMS/IPI C170 with PIS_ALIQ or COFINS_ALIQ
+        # one is the percent and another is the R$ value...
+        # other case in EFD PIS/COFINS M210.
+        # in this case we append the line field index to the dup codes
+        # the field name doesn't really matter as it is not written in the SPED file.
+        fields = fields_by_register.get(code, [])
+        code_counts = Counter(field["code"] for field in fields)
+        seen_codes = set()
+        for field in fields:
+            if code_counts[field["code"]] > 1 and field["code"] in seen_codes:
+                field["code"] = f'{field["code"]}_INDEX_{field["index"]}'
+            seen_codes.add(field["code"])
+
+        for field in fields:
+            if field["code"] in ("REG",):  # no need for DB field for fixed field
+                continue
+            if not field.get("type"):
+                field["type"] = "char"
 
-                if (
-                    field["code"].startswith("DT_")
-                    or field["code"].startswith("DAT_")
-                    or field["code"].startswith("DATA")
-                ):
-                    types = [
-                        AttrType(
-                            qname="{http://www.w3.org/2001/XMLSchema}date", native=True
-                        )
-                    ]
-                elif (
-                    field["type"] == "int"
-                    or field["type"] == "float"
-                    and field.get("decimal")
-                    and int(field["decimal"]) == 0
-                ):
-                    types = [
-                        AttrType(
-                            qname="{http://www.w3.org/2001/XMLSchema}integer",
-                            native=True,
-                        )
-                    ]
-                elif field["type"] == "float":
-                    types = [
-                        AttrType(
-                            qname="{http://www.w3.org/2001/XMLSchema}float", native=True
-                        )
-                    ]
-                else:
-                    types = [
-                        AttrType(
-                            qname="{http://www.w3.org/2001/XMLSchema}string",
-                            native=True,
-                        )
-                    ]
-                    # TODO Some string fields are in fact Selection fields!
-                # TODO diff entrada/saida e O / OC (Obrigatorio Condicional); see ICMS C170
-                restrictions = Restrictions(
-                    min_occurs=field.get("required")
-                    and 1
-                    or 0  # TODO if required 'OC' -> no
-                )
-                attr = Attr(
-                    tag=field["code"],
-                    name=field["code"],
-                    types=types,
-                    restrictions=restrictions,
-                    help=field["desc"],
-                    index=field["index"],
-                )
-                attrs.append(attr)
-
-            # TODO if register spec_in or spec_out, then add a register_type = Field.Selection(["in", "out"])
-            # only if level = 2?
-
-            #            if register["level"] == 2:
-            #                dates = list(filter(lambda x: "date" in x.types[0].qname, attrs))
-            #                if len(dates) == 1:
-            #                    print("DATE ", register["code"], dates[0].name)
-            #                    print("NO DATE IN", register["code"], [attr.name for attr in attrs])
-
-            #            for child in register["children_m2o"]:
-            #                child_qname = "Registro{}".format(child["code"])
-            #                types = [AttrType(qname=child_qname, native=False)]
-            #                m2o_field_name = "reg_{}_id".format(child["code"])
-            #                restrictions = Restrictions(
-            #                    min_occurs=0  # TODO sure?
-            #                )
-            #                attr = Attr(
-            #                    tag=m2o_field_name,
-            #                    name=m2o_field_name,
-            #                    types=types,
-            #                    restrictions=restrictions,
-            #                    help=child["code"] + ": " + child["desc"],
-            #                )
-            #                attrs.append(attr)
-
-            concrete_models_source += "    #     }"  # close fields list
-
-            if register.get("parent"):
-                parent = register["parent"]
-                parent_qname = "Registro{}".format(parent["code"])
-                types = [AttrType(qname=parent_qname, native=False)]
-                m2o_field_name = "reg_{}_ids_{}_id".format(
-                    register["code"], parent_qname
-                )
-                attr = Attr(
-                    tag=m2o_field_name,
-                    name=m2o_field_name,
-                    types=types,
-                    help=parent["desc"],
-                )
-                attrs.append(attr)
+            # listing all fields helps writting and reviewing mappings:
+            max_desc = 88 - len(field["code"]) - 29
+            reg_lines.append(
+                f"""    #         "{field["code"]}": 0,  # {field["desc"][0:max_desc]}{len(field["desc"]) > max_desc and "..." or ""}\n"""
+            )
 
-            for child in register.get("children_m2o", []) + register.get(
-                "children_o2m", []
+            if _is_date_code(field["code"]):
+                types = list(_T_DATE)
+            elif (
+                field["type"] == "int"
+                or field["type"] == "float"
+                and field.get("decimal")
+                and int(field["decimal"]) == 0
             ):
-                child_qname = "Registro{}".format(child["code"])
-                types = [AttrType(qname=child_qname, native=False)]
-                restrictions = Restrictions(max_occurs=999999)
-
-                o2m_field_name = "reg_{}_ids".format(child["code"])
-                # TODO find a way to pass string=child["code"]
-                attr = Attr(
-                    tag=o2m_field_name,
-                    name=o2m_field_name,
-                    types=types,
-                    restrictions=restrictions,
-                    help=child["code"] + " " + child["desc"],
-                )
-                attrs.append(attr)
-
-            # TODO patch ECD Registro0035
-            k = Class(
-                qname=name,
-                tag=name,
-                location="TODO",
-                attrs=attrs,
-                help=register["desc"],
-                module=mod,
+                types = list(_T_INT)
+            elif field["type"] == "float":
+                types = list(_T_FLOAT)
+            else:
+                types = list(_T_STRING)
+                # TODO Some string fields are in fact Selection fields!
+            # TODO diff entrada/saida e O / OC (Obrigatorio Condicional); see ICMS C170
+            restrictions = (
+                _REQUIRED
+                if field.get("required")  # TODO if required 'OC' -> no
+                else _OPTIONAL
+            )
+            attr = Attr(
+                tag=field["code"],
+                name=field["code"],
+                types=types,
+                restrictions=restrictions,
+                help=field["desc"],
+                index=field["index"],
+            )
+            attrs.append(attr)
+
+        # TODO if register spec_in or spec_out, then add a register_type = Field.Selection(["in", "out"])
+        # only if level = 2?
+
+        #            if register["level"] == 2:
+        #                dates = list(filter(lambda x: "date" in x.types[0].qname, attrs))
+        #                if len(dates) == 1:
+        #                    print("DATE ", register["code"], dates[0].name)
+        #                    print("NO DATE IN", register["code"], [attr.name for attr in attrs])
+
+        #            for child in register["children_m2o"]:
+        #                child_qname = "Registro{}".format(child["code"])
+        #                types = [AttrType(qname=child_qname, native=False)]
+        #                m2o_field_name = "reg_{}_id".format(child["code"])
+        #                restrictions = Restrictions(
+        #                    min_occurs=0  # TODO sure?
+        #                )
+        #                attr = Attr(
+        #                    tag=m2o_field_name,
+        #                    name=m2o_field_name,
+        #                    types=types,
+        #                    restrictions=restrictions,
+        #                    help=child["code"] + ": " + child["desc"],
+        #                )
+        #                attrs.append(attr)
+
+        reg_lines.append("    #     }")  # close fields list
+        concrete_parts.extend(reg_lines)
+
+        if register.get("parent"):
+            parent = register["parent"]
+            parent_qname = "Registro{}".format(parent["code"])
+            types = [AttrType(qname=parent_qname, native=False)]
+            m2o_field_name = "reg_{}_ids_{}_id".format(code, parent_qname)
+            attr = Attr(
+                tag=m2o_field_name,
+                name=m2o_field_name,
+                types=types,
+                help=parent["desc"],
+            )
+            attrs.append(attr)
+
+        for child in register["children_m2o"] + register["children_o2m"]:
+            child_qname = "Registro{}".format(child["code"])
+            types = [AttrType(qname=child_qname, native=False)]
+            restrictions = Restrictions(max_occurs=999999)
+
+            o2m_field_name = "reg_{}_ids".format(child["code"])
+            # TODO find a way to pass string=child["code"]
+            attr = Attr(
+                tag=o2m_field_name,
+                name=o2m_field_name,
+                types=types,
+                restrictions=restrictions,
+                help=child["code"] + " " + child["desc"],
             )
-            classes.append(k)
-            generator.filters.all_complex_types.append(k)
-            security_csv += f"access_user_{mod}_{register['code'].lower()},{mod}.{register['code'].lower()},model_l10n_br_sped_{mod}_{register['code'].lower()},l10n_br_fiscal.group_user,1,0,0,0\n"
-            security_csv += f"access_manager_{mod}_{register['code'].lower()},{mod}.{register['code'].lower()},model_l10n_br_sped_{mod}_{register['code'].lower()},l10n_br_fiscal.group_manager,1,1,1,1\n"
-
-        structure = get_structure(mod, registers)
-        source = (
-            HEADER
-            + f'\n"""\n{structure}\n"""\n\n'
-            + IMPORTS
-            + "\n"
-            + generator.render_classes(classes, None)
+            attrs.append(attr)
+
+        # TODO patch ECD Registro0035
+        k = Class(
+            qname=name,
+            tag=name,
+            location="TODO",
+            attrs=attrs,
+            help=register["desc"],
+            module=mod,
         )
+        classes.append(k)
+        model = f"model_l10n_br_sped_{mod}_{code_lc}"
+        security_writer.writerow(
+            [
+                f"access_user_{mod}_{code_lc}",
+                f"{mod}.{code_lc}",
+                model,
+                "l10n_br_fiscal.group_user",
+                1,
+                0,
+                0,
+                0,
+            ]
+        )
+        security_writer.writerow(
+            [
+                f"access_manager_{mod}_{code_lc}",
+                f"{mod}.{code_lc}",
+                model,
+                "l10n_br_fiscal.group_manager",
+                1,
+                1,
+                1,
+                1,
+            ]
+        )
+
+    generator.filters.all_complex_types.extend(classes)
+    generator.filters.all_complex_types_by_qname = {
+        klass.qname: klass for klass in generator.filters.all_complex_types
+    }
+    # indexed only now because duplicate field codes got renamed in the loop above
+    generator.filters.fields_by_register_and_code = {
+        (f["register"], f["code"]): f for f in mod_fields
+    }
+
+    structure = get_structure(mod, registers)
+    source = (
+        HEADER
+        + f'\n"""\n{structure}\n"""\n\n'
+        + IMPORTS
+        + "\n"
+        + generator.render_classes(classes, None)
+    )
+    concrete_models_source = "".join(concrete_parts)
+    if not os.environ.get("SPED_SKIP_BLACK"):
         try:
-            source = format_str(source, mode=FileMode())
-            concrete_models_source = format_str(concrete_models_source, mode=FileMode())
+            source = _format_source(source)
+            concrete_models_source = _format_source(concrete_models_source)
         except Exception as e:
             print(e)
 
-        base_path = str(SPECS_PATH) + f"/{year}/"
+    base_path = str(SPECS_PATH) + f"/{year}/"
+
+    path = Path(f"{base_path}/l10n_br_sped/models/sped_{mod}_spec_{version}.py")
+    print("written file", path)
+    path.write_text(source, encoding="utf-8")
+
+    path = Path(f"{base_path}/l10n_br_sped/models/sped_{mod}.py")
+    print("written file", path)
+    path.write_text(concrete_models_source, encoding="utf-8")
 
-        path = Path(f"{base_path}/l10n_br_sped/models/sped_{mod}_spec_{version}.py")
-        print("written file", path)
-        path.write_text(source, encoding="utf-8")
+    path = Path(f"{base_path}/l10n_br_sped/views/sped_{mod}.xml")
+    views_xml_parts.append("\n</odoo>")
+    with path.open("w", encoding="utf-8") as views_file:
+        views_file.writelines(views_xml_parts)
 
-        path = Path(f"{base_path}/l10n_br_sped/models/sped_{mod}.py")
-        print("written file", path)
-        path.write_text(concrete_models_source, encoding="utf-8")
+    path = Path(f"{base_path}/l10n_br_sped/security/{mod}_ir.model.access.csv")
+    path.write_text(security_csv.getvalue(), encoding="utf-8")
 
-        path = Path(f"{base_path}/l10n_br_sped/views/sped_{mod}.xml")
-        path.write_text(views_xml + "\n</odoo>", encoding="utf-8")
 
-        path = Path(f"{base_path}/l10n_br_sped/security/{mod}_ir.model.access.csv")
-        path.write_text(security_csv, encoding="utf-8")
+@click.option(
+    "--year",
+    default=MOST_RECENT_YEAR,
+    show_default=True,
+    type=click.IntRange(OLDEST_YEAR, MOST_RECENT_YEAR),
+    help="Operate on a specific year's folder, "
+    f"can be between {OLDEST_YEAR} and {MOST_RECENT_YEAR}",
+)
+@click.command()
+def main(year):
+    """Generate Odoo models.
+
+    Set SPED_SKIP_BLACK=1 to write the sources without black formatting.
+    """
+    # modules are independent, each one is generated in its own process:
+    with ProcessPoolExecutor(max_workers=len(MODULES)) as executor:
+        list(executor.map(functools.partial(_generate_for_module, year=year), MODULES))
 
 
 if __name__ == "__main__":